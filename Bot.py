@@ -4,13 +4,19 @@
 
 import os
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 from discord import Option
 import random
 import asyncio
 import sqlite3
 import math
+import time
 import functools
+import heapq
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 from typing import Optional, Tuple, List
 
 # ====== CONFIG ======
@@ -24,6 +30,10 @@ LEVEL_MULTIPLIER = 100
 XP_COOLDOWN = 60
 REACTION_COOLDOWN = 90
 STATUS_INTERVAL = 20
+COOLDOWN_SWEEP_INTERVAL = 300   # seconds between pruning expired cooldowns
+DB_READERS = 4                  # threads serving read-only queries
+XP_FLUSH_INTERVAL = 5           # seconds between batched XP writes
+XP_CACHE_SIZE = 10000           # max clean XP records kept in memory
 DB_PATH = "xp_data.db"
 # ====================
 
@@ -33,13 +43,23 @@ intents.members = True
 intents.reactions = True
 
 bot = commands.Bot(command_prefix="!", intents=intents)
-cooldowns = {}  # Stores cooldown timestamps for XP gain
+# Cooldown timestamps for XP gain, keyed by (guild_id, user_id)
+msg_cd = {}
+react_cd = {}
+bot.time = time.monotonic  # replaced by the running loop's clock in on_ready
+bot.owner_user = None      # resolved once in on_ready for DM forwarding
+bot._scheduler_task = None  # keeps the periodic-jobs task referenced (see on_ready)
 
 # ====== SQLite (sync) setup but run blocking ops in executor ======
+# `conn` is the only write connection and is used solely from writer_executor's thread
 conn = sqlite3.connect(DB_PATH, check_same_thread=False)
 conn.row_factory = sqlite3.Row
+# WAL lets readers run alongside the writer; busy_timeout retries instead of "database is locked"
+for pragma in ("journal_mode=WAL", "synchronous=NORMAL", "busy_timeout=30000", "temp_store=MEMORY", "cache_size=-20000"):
+    conn.execute(f"PRAGMA {pragma}")
+if conn.execute("PRAGMA journal_mode").fetchone()[0] != "wal":
+    print("[WARN] SQLite WAL mode unavailable, using default journal")
 cursor = conn.cursor()
-db_lock = asyncio.Lock()  # protect against concurrent writes at Python level
 
 def init_db_sync():
     cursor.execute("""
@@ -60,62 +80,176 @@ def init_db_sync():
         guild_id INTEGER PRIMARY KEY,
         levelup_channel INTEGER
     )""")
+    # covering index so leaderboard / top-user ORDER BY needs no sort
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_xp_rank
+        ON xp_data (guild_id, level DESC, xp DESC, user_id)
+    """)
     conn.commit()
+    cursor.execute("ANALYZE")
+
+# Read-mostly per-guild config, loaded once and kept in sync by the setters
+REWARD_ROLE_CACHE = {}  # guild_id -> role_id
+LEVELUP_CH_CACHE = {}   # guild_id -> channel_id
+
+def load_guild_config_sync():
+    for row in cursor.execute("SELECT guild_id, role_id FROM reward_roles"):
+        if row["role_id"] is not None:
+            REWARD_ROLE_CACHE[int(row["guild_id"])] = int(row["role_id"])
+    for row in cursor.execute("SELECT guild_id, levelup_channel FROM guild_settings"):
+        if row["levelup_channel"] is not None:
+            LEVELUP_CH_CACHE[int(row["guild_id"])] = int(row["levelup_channel"])
 
 # run the sync init at import/start
 init_db_sync()
-
-# Helper to run blocking DB calls in executor
+load_guild_config_sync()
+
+# Writes are serialized on one thread; reads use per-thread read-only connections (WAL).
+# Connections live as long as their thread, so the page cache stays warm between queries.
+_reader_local = threading.local()
+_reader_conns = []  # every reader connection, closed by close_db_sync()
+
+def _reader_conn() -> sqlite3.Connection:
+    # opened lazily per reader thread, so a failed connect is retried on the next query
+    rconn = getattr(_reader_local, "conn", None)
+    if rconn is None:
+        rconn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False)
+        rconn.row_factory = sqlite3.Row
+        rconn.execute("PRAGMA busy_timeout=30000")
+        _reader_local.conn = rconn
+        _reader_conns.append(rconn)
+    return rconn
+
+writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+reader_executor = ThreadPoolExecutor(max_workers=DB_READERS, thread_name_prefix="db-reader")
+
+def close_db_sync():
+    # used at shutdown, once the event loop is gone
+    flush_xp_sync()
+    reader_executor.shutdown(wait=True)
+    writer_executor.shutdown(wait=True)
+    for rconn in _reader_conns:
+        rconn.close()
+    conn.close()  # last connection out checkpoints the WAL
+
+# Helpers to run blocking DB calls in executor
 async def run_db(func, /, *args, commit: bool = False):
     loop = asyncio.get_running_loop()
-    # wrap to execute under db_lock to help avoid sqlite db locked issues
-    async with db_lock:
-        return await loop.run_in_executor(None, functools.partial(_db_call_sync, func, args, commit))
+    return await loop.run_in_executor(writer_executor, functools.partial(_db_call_sync, func, args, commit))
+
+async def run_db_read(func, /, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(reader_executor, functools.partial(func, *args))
 
 def _db_call_sync(func, args, commit):
-    try:
-        result = func(*args)
-        if commit:
-            conn.commit()
-        return result
-    except Exception as e:
-        # propagate to caller via exception
-        raise
+    # exceptions propagate to the awaiting caller
+    result = func(*args)
+    if commit:
+        conn.commit()
+    return result
 
 # Very small sync helper wrappers for common queries
+# (_fetchone_sync/_fetchall_sync go through run_db_read, the rest through run_db)
 def _fetchone_sync(query, params=()):
-    cur = conn.cursor()
-    cur.execute(query, params)
-    return cur.fetchone()
+    return _reader_conn().execute(query, params).fetchone()
 
 def _fetchall_sync(query, params=()):
-    cur = conn.cursor()
-    cur.execute(query, params)
-    return cur.fetchall()
+    return _reader_conn().execute(query, params).fetchall()
 
 def _execute_sync(query, params=()):
-    cur = conn.cursor()
-    cur.execute(query, params)
-    return cur
+    return conn.execute(query, params)
+
+def _executemany_sync(query, seq_of_params):
+    return conn.executemany(query, seq_of_params)
+
+# Query text is kept constant so sqlite3's per-connection statement cache is reused
+_SQL_GET_USER = "SELECT xp, level FROM xp_data WHERE user_id = ? AND guild_id = ?"
+_SQL_UPSERT_XP = "INSERT INTO xp_data (user_id, guild_id, xp, level) VALUES (?, ?, ?, ?) ON CONFLICT (user_id, guild_id) DO UPDATE SET xp = excluded.xp, level = excluded.level"
+_SQL_DELETE_USER = "DELETE FROM xp_data WHERE user_id = ? AND guild_id = ?"
+_SQL_TOP_USER = "SELECT user_id FROM xp_data WHERE guild_id = ? ORDER BY level DESC, xp DESC LIMIT 1"
+_SQL_LEADERBOARD = "SELECT user_id, xp, level FROM xp_data WHERE guild_id = ? ORDER BY level DESC, xp DESC LIMIT 10"
+_SQL_SET_REWARD_ROLE = "INSERT OR REPLACE INTO reward_roles (guild_id, role_id) VALUES (?, ?)"
+_SQL_SET_LEVEL_CHANNEL = "INSERT OR REPLACE INTO guild_settings (guild_id, levelup_channel) VALUES (?, ?)"
 
 # ====== XP helpers (async wrappers around sync DB) ======
 def xp_for_next_level(level: int) -> int:
     # Linear formula (keeps your original style). Change if desired.
     return level * LEVEL_MULTIPLIER
 
-async def get_user_data(user_id: int, guild_id: int) -> dict:
-    row = await run_db(_fetchone_sync, f"SELECT xp, level FROM xp_data WHERE user_id = ? AND guild_id = ?", (user_id, guild_id))
-    if row:
-        return {"xp": row["xp"], "level": row["level"]}
-    # create default
-    await run_db(_execute_sync, "INSERT OR REPLACE INTO xp_data (user_id, guild_id, xp, level) VALUES (?, ?, 0, 1)", (user_id, guild_id), commit=True)
-    return {"xp": 0, "level": 1}
+# In-memory write-back cache: the hot path only touches these dicts,
+# the scheduler's flush_xp() persists dirty records in one batched transaction.
+xp_cache = OrderedDict()  # (user_id, guild_id) -> {"xp", "level"}, LRU order
+dirty_xp = {}             # (user_id, guild_id) -> record awaiting flush
+top_dirty = set()         # guild_ids whose ranking changed since the last top check
+
+async def get_xp_record(user_id: int, guild_id: int) -> dict:
+    key = (user_id, guild_id)
+    data = xp_cache.get(key)
+    if data is not None:
+        xp_cache.move_to_end(key)
+        return data
+    # an unsaved record is newer than its row, never reload it from the database
+    data = dirty_xp.get(key)
+    if data is None:
+        row = await run_db_read(_fetchone_sync, _SQL_GET_USER, (user_id, guild_id))
+        # another coroutine may have loaded the same key while we were waiting
+        data = xp_cache.get(key) or dirty_xp.get(key)
+        if data is None:
+            data = {"xp": row["xp"], "level": row["level"]} if row else {"xp": 0, "level": 1}
+    xp_cache[key] = data
+    xp_cache.move_to_end(key)
+    evict_clean_xp(keep=key)
+    return data
+
+def mark_xp_dirty(user_id: int, guild_id: int, data: dict):
+    dirty_xp[(user_id, guild_id)] = data
+    top_dirty.add(guild_id)  # re-check this guild's top user on the next periodic pass
+
+def evict_clean_xp(keep: Optional[Tuple[int, int]] = None):
+    # drop least recently used records that are already persisted
+    # (`keep` is the record being handed to a caller, which must stay cached)
+    excess = len(xp_cache) - XP_CACHE_SIZE
+    if excess <= 0:
+        return
+    # walk from the LRU end and stop once enough clean keys are found
+    victims = []
+    for key in xp_cache:
+        if key != keep and key not in dirty_xp:
+            victims.append(key)
+            if len(victims) == excess:
+                break
+    for key in victims:
+        del xp_cache[key]
+
+async def flush_xp():
+    if not dirty_xp:
+        return
+    batch = list(dirty_xp.items())
+    rows = [(uid, gid, data["xp"], data["level"]) for (uid, gid), data in batch]
+    try:
+        await run_db(_executemany_sync, _SQL_UPSERT_XP, rows, commit=True)
+    except Exception as e:
+        # records stay dirty so the next flush retries them
+        print("flush_xp error:", e)
+        return
+    # records are only clean (and evictable) once written; skip ones changed meanwhile
+    for (key, data), row in zip(batch, rows):
+        if dirty_xp.get(key) is data and (data["xp"], data["level"]) == row[2:]:
+            del dirty_xp[key]
+    evict_clean_xp()
+
+def flush_xp_sync():
+    # used by close_db_sync()
+    rows = [(uid, gid, data["xp"], data["level"]) for (uid, gid), data in dirty_xp.items()]
+    if rows:
+        writer_executor.submit(_db_call_sync, _executemany_sync, (_SQL_UPSERT_XP, rows), True).result()
+        dirty_xp.clear()
 
-async def update_user_data(user_id: int, guild_id: int, xp: int, level: int):
-    await run_db(_execute_sync, "UPDATE xp_data SET xp = ?, level = ? WHERE user_id = ? AND guild_id = ?", (xp, level, user_id, guild_id), commit=True)
+async def get_user_data(user_id: int, guild_id: int) -> dict:
+    return dict(await get_xp_record(user_id, guild_id))
 
 async def add_xp(user: discord.User, guild: discord.Guild, amount: int) -> Tuple[bool, int]:
-    data = await get_user_data(user.id, guild.id)
+    data = await get_xp_record(user.id, guild.id)
     data["xp"] += amount
     leveled_up = False
     next_level = xp_for_next_level(data["level"])
@@ -123,40 +257,30 @@ async def add_xp(user: discord.User, guild: discord.Guild, amount: int) -> Tuple
         data["level"] += 1
         data["xp"] -= next_level
         leveled_up = True
-    await update_user_data(user.id, guild.id, data["xp"], data["level"])
-
-    # schedule top-user check (fire-and-forget)
-    try:
-        bot.loop.create_task(check_top_user_change(guild))
-    except Exception:
-        pass
+    mark_xp_dirty(user.id, guild.id, data)
     return leveled_up, data["level"]
 
 async def get_top_user_id(guild_id: int) -> Optional[int]:
-    row = await run_db(_fetchone_sync, "SELECT user_id FROM xp_data WHERE guild_id = ? ORDER BY level DESC, xp DESC LIMIT 1", (guild_id,))
+    row = await run_db_read(_fetchone_sync, _SQL_TOP_USER, (guild_id,))
     return int(row["user_id"]) if row else None
 
-async def get_reward_role_id(guild_id: int) -> Optional[int]:
-    row = await run_db(_fetchone_sync, "SELECT role_id FROM reward_roles WHERE guild_id = ?", (guild_id,))
-    return int(row["role_id"]) if row else None
+def get_reward_role_id(guild_id: int) -> Optional[int]:
+    return REWARD_ROLE_CACHE.get(guild_id)
 
 async def set_reward_role_id(guild_id: int, role_id: int):
-    await run_db(_execute_sync, "INSERT OR REPLACE INTO reward_roles (guild_id, role_id) VALUES (?, ?)", (guild_id, role_id), commit=True)
+    await run_db(_execute_sync, _SQL_SET_REWARD_ROLE, (guild_id, role_id), commit=True)
+    REWARD_ROLE_CACHE[guild_id] = role_id
 
-async def get_level_channel_id(guild_id: int) -> Optional[int]:
-    row = await run_db(_fetchone_sync, "SELECT levelup_channel FROM guild_settings WHERE guild_id = ?", (guild_id,))
-    return int(row["levelup_channel"]) if row and row["levelup_channel"] is not None else None
+def get_level_channel_id(guild_id: int) -> Optional[int]:
+    return LEVELUP_CH_CACHE.get(guild_id)
 
 async def set_level_channel_id(guild_id: int, channel_id: int):
-    await run_db(_execute_sync, "INSERT OR REPLACE INTO guild_settings (guild_id, levelup_channel) VALUES (?, ?)", (guild_id, channel_id), commit=True)
+    await run_db(_execute_sync, _SQL_SET_LEVEL_CHANNEL, (guild_id, channel_id), commit=True)
+    LEVELUP_CH_CACHE[guild_id] = channel_id
 
 async def add_xp_manual(user_id: int, guild_id: int, amount: int) -> Tuple[bool, int]:
-    # convenience for admin xp commands
-    dummy_user = discord.Object(id=user_id)
-    guild_dummy = discord.Object(id=guild_id)
-    # Use add_xp but we need a discord.User and discord.Guild for the function signature;
-    # we'll call DB helpers directly to avoid object issues:
-    data = await get_user_data(user_id, guild_id)
+    # convenience for admin xp commands; works on ids so no discord objects are needed
+    data = await get_xp_record(user_id, guild_id)
     data["xp"] += amount
     leveled_up = False
     next_level = xp_for_next_level(data["level"])
@@ -165,19 +289,26 @@ async def add_xp_manual(user_id: int, guild_id: int, amount: int) -> Tuple[bool,
         data["xp"] -= next_level
         leveled_up = True
         next_level = xp_for_next_level(data["level"])
-    await update_user_data(user_id, guild_id, data["xp"], data["level"])
+    mark_xp_dirty(user_id, guild_id, data)
     # return new level
     return leveled_up, data["level"]
 
 async def remove_user_xp(user_id: int, guild_id: int, amount: int) -> int:
-    data = await get_user_data(user_id, guild_id)
+    data = await get_xp_record(user_id, guild_id)
     data["xp"] = max(0, data["xp"] - amount)
     # do not change level automatically here; admin intent is to reduce xp only
-    await update_user_data(user_id, guild_id, data["xp"], data["level"])
+    mark_xp_dirty(user_id, guild_id, data)
     return data["xp"]
 
 async def reset_user_xp(user_id: int, guild_id: int):
-    await run_db(_execute_sync, "DELETE FROM xp_data WHERE user_id = ? AND guild_id = ?", (user_id, guild_id), commit=True)
+    key = (user_id, guild_id)
+    dirty_xp.pop(key, None)
+    # cache a fresh record rather than dropping the key, so XP gained while the
+    # DELETE is pending starts from zero instead of re-reading the old row
+    xp_cache[key] = {"xp": 0, "level": 1}
+    xp_cache.move_to_end(key)
+    top_dirty.add(guild_id)
+    await run_db(_execute_sync, _SQL_DELETE_USER, (user_id, guild_id), commit=True)
 
 # ====== Admin check helper ======
 def is_admin_member(member: discord.Member) -> bool:
@@ -202,7 +333,7 @@ async def check_top_user_change(guild: discord.Guild):
 
         last_top_user[guild_id] = top_id
 
-        role_id = await get_reward_role_id(guild_id)
+        role_id = get_reward_role_id(guild_id)
         if not role_id:
             return
 
@@ -216,7 +347,8 @@ async def check_top_user_change(guild: discord.Guild):
             try:
                 prev_member = guild.get_member(int(prev))
                 if prev_member and role in prev_member.roles:
-                    await prev_member.remove_roles(role, reason="New top user replaced previous top")
+                    await prev_member.edit(roles=[r for r in prev_member.roles[1:] if r.id != role.id],
+                                           reason="New top user replaced previous top")
             except Exception as e:
                 print("Failed removing role from prev:", e)
 
@@ -224,7 +356,9 @@ async def check_top_user_change(guild: discord.Guild):
         new_member = guild.get_member(int(top_id))
         if new_member:
             try:
-                await new_member.add_roles(role, reason="Assigned reward role to top XP user")
+                if role not in new_member.roles:
+                    # one Modify Guild Member call with the full role list (roles[0] is @everyone)
+                    await new_member.edit(roles=new_member.roles[1:] + [role], reason="Assigned reward role to top XP user")
                 ch = guild.system_channel
                 if ch:
                     await ch.send(f"🏅 Congrats {new_member.mention} — you're now #1 in {guild.name}! You got {role.mention}.")
@@ -236,34 +370,49 @@ async def check_top_user_change(guild: discord.Guild):
     except Exception as exc:
         print("check_top_user_change error:", exc)
 
-@tasks.loop(seconds=TOP_CHECK_INTERVAL)
 async def periodic_top_check():
-    await bot.wait_until_ready()
-    for guild in bot.guilds:
+    await flush_xp()  # rank from up-to-date rows
+    guild_ids = list(top_dirty)
+    top_dirty.clear()
+    for guild_id in guild_ids:
+        guild = bot.get_guild(guild_id)
+        if not guild:
+            continue
         try:
             await check_top_user_change(guild)
         except Exception as e:
             print("periodic_top_check inner error:", e)
 
+# keep cooldown dicts sized to recently active users
+async def sweep_cooldowns():
+    now = bot.time()
+    for cd, window in ((msg_cd, 3 * XP_COOLDOWN), (react_cd, 3 * REACTION_COOLDOWN)):
+        for key, ts in list(cd.items()):
+            if now - ts > window:
+                del cd[key]
+
 # ====== DM forwarding (unaltered) ======
 @bot.event
 async def on_message(message: discord.Message):
     # 1) DM forwarding
     if isinstance(message.channel, discord.DMChannel) and not message.author.bot:
         try:
-            owner = await bot.fetch_user(OWNER_ID)
+            if bot.owner_user is None:
+                bot.owner_user = await bot.fetch_user(OWNER_ID)
+            owner = bot.owner_user
             embed = discord.Embed(title="✉️ New DM to Bot",
                                   description=message.content or "[No text]",
                                   color=discord.Color.blurple())
             embed.set_author(name=f"{message.author} ({message.author.id})", icon_url=getattr(message.author.display_avatar, "url", None))
             embed.set_footer(text="Forwarded automatically")
             await owner.send(embed=embed)
-            # forward attachments
-            for att in message.attachments:
+            # forward attachments concurrently
+            async def _fwd(att: discord.Attachment):
                 try:
                     await owner.send(file=await att.to_file())
                 except Exception:
                     pass
+            await asyncio.gather(*(_fwd(att) for att in message.attachments))
         except Exception as e:
             print("Failed forwarding DM:", e)
         return  # do not process DMs further
@@ -276,16 +425,16 @@ async def on_message(message: discord.Message):
 
     guild_id = message.guild.id
     user_id = message.author.id
-    now = asyncio.get_event_loop().time()
-    last_time = cooldowns.get((guild_id, user_id), 0)
+    now = bot.time()
+    last_time = msg_cd.get((guild_id, user_id), 0)
 
     if now - last_time >= XP_COOLDOWN:
         exp_gain = random.randint(*XP_PER_MESSAGE)
         leveled_up, level = await add_xp(message.author, message.guild, exp_gain)
-        cooldowns[(guild_id, user_id)] = now
+        msg_cd[(guild_id, user_id)] = now
         if leveled_up:
             # pick the configured level-up channel if set, else use message.channel
-            channel_id = await get_level_channel_id(guild_id)
+            channel_id = get_level_channel_id(guild_id)
             ch = message.guild.get_channel(channel_id) if channel_id else message.channel
             try:
                 embed = discord.Embed(title="Level Up!", description=f"{message.author.mention} just reached **Level {level}** 🎉", color=discord.Color.green())
@@ -301,28 +450,27 @@ async def on_reaction_add(reaction: discord.Reaction, user: discord.User):
     if user.bot or not reaction.message.guild:
         return
 
-    guild_id = reaction.message.guild.id
-    now = asyncio.get_event_loop().time()
-    last_time = cooldowns.get((guild_id, f"react_{user.id}"), 0)
+    guild = reaction.message.guild
+    now = bot.time()
 
-    if now - last_time >= REACTION_COOLDOWN:
-        exp_gain = random.randint(*XP_PER_REACTION)
-        leveled_up, level = await add_xp(user, reaction.message.guild, exp_gain)
-        cooldowns[(guild_id, f"react_{user.id}")] = now
-        if leveled_up:
+    async def _grant(member: discord.abc.User, announce: bool):
+        key = (guild.id, member.id)
+        if now - react_cd.get(key, 0) < REACTION_COOLDOWN:
+            return
+        react_cd[key] = now  # set before awaiting so reactor == author is only paid once
+        leveled_up, level = await add_xp(member, guild, random.randint(*XP_PER_REACTION))
+        if leveled_up and announce:
             try:
-                await reaction.message.channel.send(f"⭐ {user.mention} leveled up to **Level {level}** via reactions!")
+                await reaction.message.channel.send(f"⭐ {member.mention} leveled up to **Level {level}** via reactions!")
             except Exception:
                 pass
 
     # give xp to message author as well (like earlier)
     author = reaction.message.author
-    if author and not author.bot:
-        last_author = cooldowns.get((guild_id, f"react_{author.id}"), 0)
-        if now - last_author >= REACTION_COOLDOWN:
-            exp_gain = random.randint(*XP_PER_REACTION)
-            await add_xp(author, reaction.message.guild, exp_gain)
-            cooldowns[(guild_id, f"react_{author.id}")] = now
+    await asyncio.gather(
+        _grant(user, announce=True),
+        _grant(author, announce=False) if author and not author.bot else asyncio.sleep(0),
+    )
 
 # ====== Commands: prefix and slash versions (embeds) ======
 def build_rank_embed(member: discord.Member, data: dict) -> discord.Embed:
@@ -349,27 +497,26 @@ async def rank(ctx, member: Option(discord.Member, "member to check", required=F
 # Leaderboard helper
 def format_leaderboard_embed(guild: discord.Guild, rows: List[sqlite3.Row]) -> discord.Embed:
     embed = discord.Embed(title=f"🏆 {guild.name} Leaderboard", color=discord.Color.gold())
-    desc = ""
-    for i, row in enumerate(rows, start=1):
-        uid = int(row["user_id"])
-        xp = row["xp"]
-        lvl = row["level"]
-        member = guild.get_member(uid)
-        name = member.display_name if member else f"<@{uid}>"
-        desc += f"**{i}.** {name} — Level {lvl} ({xp} XP)\n"
-    embed.description = desc or "No XP data found."
+    get_member = guild.get_member  # member cache lookup, no API calls
+    lines = [f"**{i}.** {member.display_name if member else f'<@{uid}>'} — Level {row['level']} ({row['xp']} XP)"
+             for i, row in enumerate(rows, start=1)
+             for uid in (int(row["user_id"]),)
+             for member in (get_member(uid),)]
+    embed.description = "\n".join(lines) or "No XP data found."
     return embed
 
 # !leaderboard
 @bot.command(name="leaderboard")
 async def leaderboard_prefix(ctx: commands.Context):
-    rows = await run_db(_fetchall_sync, "SELECT user_id, xp, level FROM xp_data WHERE guild_id = ? ORDER BY level DESC, xp DESC LIMIT 10", (ctx.guild.id,))
+    await flush_xp()
+    rows = await run_db_read(_fetchall_sync, _SQL_LEADERBOARD, (ctx.guild.id,))
     await ctx.send(embed=format_leaderboard_embed(ctx.guild, rows))
 
 # /leaderboard
 @bot.slash_command(description="Show server leaderboard")
 async def leaderboard(ctx):
-    rows = await run_db(_fetchall_sync, "SELECT user_id, xp, level FROM xp_data WHERE guild_id = ? ORDER BY level DESC, xp DESC LIMIT 10", (ctx.guild.id,))
+    await flush_xp()
+    rows = await run_db_read(_fetchall_sync, _SQL_LEADERBOARD, (ctx.guild.id,))
     await ctx.respond(embed=format_leaderboard_embed(ctx.guild, rows))
 
  
@@ -510,40 +657,63 @@ async def dm_prefix(ctx: commands.Context, user: discord.User, *, message_conten
         await ctx.send(f"❌ Failed to DM: {e}")
 
 # ====== Status rotation (same idea) ======
-STATUS_ITEMS = [
-    {"type": "playing",  "name": "and Leveling up across servers"},
-    {"type": "watching", "name": "the leaderboards 👀"},
-    {"type": "listening", "name": "to /rank commands"}
+STATUS_ACTIVITIES = [
+    discord.Game(name="and Leveling up across servers"),
+    discord.Activity(type=discord.ActivityType.watching, name="the leaderboards 👀"),
+    discord.Activity(type=discord.ActivityType.listening, name="to /rank commands"),
+]
+
+_status_cycle = itertools.cycle(STATUS_ACTIVITIES)
+
+async def rotate_status():
+    await bot.change_presence(activity=next(_status_cycle))
+
+# ====== Periodic jobs, run by one scheduler task ======
+PERIODIC_JOBS = [
+    (XP_FLUSH_INTERVAL, flush_xp),
+    (STATUS_INTERVAL, rotate_status),
+    (TOP_CHECK_INTERVAL, periodic_top_check),
+    (COOLDOWN_SWEEP_INTERVAL, sweep_cooldowns),
 ]
 
-async def status_loop():
+async def _run_job(job):
+    try:
+        await job()
+    except Exception as e:
+        print(f"{job.__name__} error:", e)
+
+async def scheduler():
     await bot.wait_until_ready()
-    i = 0
+    loop = asyncio.get_running_loop()
+    # (next_run, index, interval, job); index breaks ties so jobs are never compared
+    heap = [(loop.time(), i, interval, job) for i, (interval, job) in enumerate(PERIODIC_JOBS)]
+    heapq.heapify(heap)
+    running = {}  # index -> task; jobs run as tasks so slow REST calls never delay flush_xp
     while not bot.is_closed():
-        item = STATUS_ITEMS[i % len(STATUS_ITEMS)]
-        try:
-            if item["type"] == "playing":
-                await bot.change_presence(activity=discord.Game(name=item["name"]))
-            elif item["type"] == "watching":
-                await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.watching, name=item["name"]))
-            elif item["type"] == "listening":
-                await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.listening, name=item["name"]))
-        except Exception:
-            pass
-        i += 1
-        await asyncio.sleep(STATUS_INTERVAL)
+        delay = heap[0][0] - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        next_run, i, interval, job = heapq.heappop(heap)
+        task = running.get(i)
+        if task is None or task.done():  # skip a tick rather than overlap a slow run
+            running[i] = asyncio.create_task(_run_job(job))
+        heapq.heappush(heap, (max(next_run + interval, loop.time()), i, interval, job))
 
 # ====== Startup handlers ======
 @bot.event
 async def on_ready():
     print(f"✅ Logged in as {bot.user} (ID: {bot.user.id})")
-    # start periodic check/task if not already started
-    if not periodic_top_check.is_running():
-        periodic_top_check.start()
-    # start status loop task
-    if not hasattr(bot, "_status_task_started"):
-        bot.loop.create_task(status_loop())
-        bot._status_task_started = True
+    bot.time = asyncio.get_running_loop().time
+    if bot.owner_user is None:
+        try:
+            bot.owner_user = bot.get_user(OWNER_ID) or await bot.fetch_user(OWNER_ID)
+        except Exception as e:
+            print("Failed fetching owner user:", e)
+    # sync reward roles once for every guild, afterwards only changed guilds are checked
+    top_dirty.update(g.id for g in bot.guilds)
+    # start the periodic jobs once (on_ready can fire again after reconnects)
+    if bot._scheduler_task is None:
+        bot._scheduler_task = asyncio.create_task(scheduler())
     # try to sync commands
     try:
         if hasattr(bot, "sync_commands"):
@@ -562,12 +732,10 @@ async def on_ready():
 async def on_guild_join(guild):
     # Try to find a general or system channel to send welcome
     channel = guild.system_channel
-    if not channel:
+    if not channel and guild.me.guild_permissions.send_messages:
         # fallback: find first text channel bot can send messages in
-        for ch in guild.text_channels:
-            if ch.permissions_for(guild.me).send_messages:
-                channel = ch
-                break
+        # (skipped without the server-wide permission to avoid per-channel overwrite checks)
+        channel = next((ch for ch in guild.text_channels if ch.permissions_for(guild.me).send_messages), None)
     if not channel:
         return
 
@@ -594,5 +762,9 @@ async def on_guild_join(guild):
 # ====== Run bot ======
 if __name__ == "__main__":
     # start bot
-    bot.run(BOT_TOKEN)
+    try:
+        bot.run(BOT_TOKEN)
+    finally:
+        # persist any XP still waiting for the next flush and close connections
+        close_db_sync()
       